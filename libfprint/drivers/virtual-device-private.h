@@ -72,6 +72,7 @@ struct _FpDeviceVirtualDevice
   GCancellable             *cancellable;
 
   char                      recv_buf[MAX_LINE_LEN];
+  GString                  *recv_data;
 
   GPtrArray                *pending_commands;
 
@@ -49,6 +49,7 @@ G_DEFINE_TYPE (FpDeviceVirtualDevice, fpi_device_virtual_device, FP_TYPE_DEVICE)
 
 #define LIST_CMD "LIST"
 #define UNPLUG_CMD "UNPLUG"
+#define RESET_CMD "RESET"
 
 static void
 maybe_continue_current_action (FpDeviceVirtualDevice *self)
@@ -270,6 +271,131 @@ write_key_to_listener (void *key, void *val, void *user_data)
     g_warning ("Error writing reply to LIST command");
 }
 
+/* Returns FALSE if the connection got closed and nothing more should be read */
+static gboolean
+process_instruction (FpDeviceVirtualDevice    *self,
+                     FpiDeviceVirtualListener *listener,
+                     char                     *instruction)
+{
+  g_autofree char *cmd = instruction;
+
+  fp_dbg ("Received command %s", cmd);
+
+  if (g_str_has_prefix (cmd, LIST_CMD))
+    {
+      if (self->prints_storage)
+        g_hash_table_foreach (self->prints_storage, write_key_to_listener, listener);
+
+      /* The client reads the reply until the connection is closed */
+      fpi_device_virtual_listener_connection_close (listener);
+      return FALSE;
+    }
+  else if (g_str_has_prefix (cmd, UNPLUG_CMD))
+    {
+      fpi_device_remove (FP_DEVICE (self));
+      maybe_continue_current_action (self);
+    }
+  else if (g_str_has_prefix (cmd, RESET_CMD))
+    {
+      /* Commands still queued may change the storage again, drop them too */
+      g_ptr_array_set_size (self->pending_commands, 0);
+      if (self->prints_storage)
+        g_hash_table_remove_all (self->prints_storage);
+    }
+  else if (g_str_has_prefix (cmd, SET_ENROLL_STAGES_PREFIX))
+    {
+      guint stages;
+
+      stages = g_ascii_strtoull (cmd + strlen (SET_ENROLL_STAGES_PREFIX), NULL, 10);
+      fpi_device_set_nr_enroll_stages (FP_DEVICE (self), stages);
+    }
+  else if (g_str_has_prefix (cmd, SET_SCAN_TYPE_PREFIX))
+    {
+      const char *scan_type = cmd + strlen (SET_SCAN_TYPE_PREFIX);
+      g_autoptr(GEnumClass) scan_types = g_type_class_ref (fp_scan_type_get_type ());
+      GEnumValue *value = g_enum_get_value_by_nick (scan_types, scan_type);
+
+      if (value)
+        fpi_device_set_scan_type (FP_DEVICE (self), value->value);
+      else
+        g_warning ("Scan type '%s' not found", scan_type);
+    }
+  else if (g_str_has_prefix (cmd, SET_CANCELLATION_PREFIX))
+    {
+      self->supports_cancellation = g_ascii_strtoull (
+        cmd + strlen (SET_CANCELLATION_PREFIX), NULL, 10) != 0;
+
+      g_debug ("Cancellation support toggled: %d",
+               self->supports_cancellation);
+    }
+  else if (g_str_has_prefix (cmd, SET_KEEP_ALIVE_PREFIX))
+    {
+      self->keep_alive = g_ascii_strtoull (
+        cmd + strlen (SET_KEEP_ALIVE_PREFIX), NULL, 10) != 0;
+
+      g_debug ("Keep alive toggled: %d", self->keep_alive);
+    }
+  else
+    {
+      g_ptr_array_add (self->pending_commands, g_steal_pointer (&cmd));
+      g_clear_handle_id (&self->wait_command_id, g_source_remove);
+
+      maybe_continue_current_action (self);
+    }
+
+  return TRUE;
+}
+
+/* Commands are newline terminated, so that a client can keep the connection
+ * open and send many of them. Anything after the last newline is kept until
+ * more data arrives. */
+static gboolean
+process_received_data (FpDeviceVirtualDevice    *self,
+                       FpiDeviceVirtualListener *listener)
+{
+  char *line_end;
+
+  while ((line_end = memchr (self->recv_data->str, '\n', self->recv_data->len)))
+    {
+      gsize len = line_end - self->recv_data->str;
+      char *cmd = g_strndup (self->recv_data->str, len);
+
+      g_string_erase (self->recv_data, 0, len + 1);
+
+      if (len == 0)
+        {
+          g_free (cmd);
+          continue;
+        }
+
+      if (!process_instruction (self, listener, cmd))
+        {
+          g_string_truncate (self->recv_data, 0);
+          return FALSE;
+        }
+    }
+
+  return TRUE;
+}
+
+/* A client closing the connection terminates its last command too */
+static gboolean
+flush_received_data (FpDeviceVirtualDevice    *self,
+                     FpiDeviceVirtualListener *listener)
+{
+  char *cmd;
+
+  if (self->recv_data->len == 0)
+    return TRUE;
+
+  cmd = g_strndup (self->recv_data->str, self->recv_data->len);
+  g_string_truncate (self->recv_data, 0);
+
+  return process_instruction (self, listener, cmd);
+}
+
+static void recv_instruction (FpDeviceVirtualDevice *self);
+
 static void
 recv_instruction_cb (GObject      *source_object,
                      GAsyncResult *res,
@@ -277,6 +403,7 @@ recv_instruction_cb (GObject      *source_object,
 {
   g_autoptr(GError) error = NULL;
   FpiDeviceVirtualListener *listener = FPI_DEVICE_VIRTUAL_LISTENER (source_object);
+  FpDeviceVirtualDevice *self;
   gsize bytes;
 
   bytes = fpi_device_virtual_listener_read_finish (listener, res, &error);
@@ -284,76 +411,43 @@ recv_instruction_cb (GObject      *source_object,
 
   if (error)
     {
-      if (g_error_matches (error, G_IO_ERROR, G_IO_ERROR_CANCELLED))
+      if (g_error_matches (error, G_IO_ERROR, G_IO_ERROR_CANCELLED) ||
+          g_error_matches (error, G_IO_ERROR, G_IO_ERROR_CLOSED))
         return;
 
-      g_warning ("Error receiving instruction data: %s", error->message);
-      return;
-    }
-
-  if (bytes > 0)
-    {
-      FpDeviceVirtualDevice *self;
-      g_autofree char *cmd = NULL;
-
-      self = FP_DEVICE_VIRTUAL_DEVICE (user_data);
-
-      cmd = g_strndup (self->recv_buf, bytes);
-      fp_dbg ("Received command %s", cmd);
-
-      if (g_str_has_prefix (cmd, LIST_CMD))
+      /* The listener reports the client closing the connection as empty data */
+      if (g_error_matches (error, G_IO_ERROR, G_IO_ERROR_INVALID_DATA))
         {
-          if (self->prints_storage)
-            g_hash_table_foreach (self->prints_storage, write_key_to_listener, listener);
-        }
-      else if (g_str_has_prefix (cmd, UNPLUG_CMD))
-        {
-          fpi_device_remove (FP_DEVICE (self));
-          maybe_continue_current_action (self);
-        }
-      else if (g_str_has_prefix (cmd, SET_ENROLL_STAGES_PREFIX))
-        {
-          guint stages;
-
-          stages = g_ascii_strtoull (cmd + strlen (SET_ENROLL_STAGES_PREFIX), NULL, 10);
-          fpi_device_set_nr_enroll_stages (FP_DEVICE (self), stages);
+          flush_received_data (FP_DEVICE_VIRTUAL_DEVICE (user_data), listener);
+          return;
         }
-      else if (g_str_has_prefix (cmd, SET_SCAN_TYPE_PREFIX))
-        {
-          const char *scan_type = cmd + strlen (SET_SCAN_TYPE_PREFIX);
-          g_autoptr(GEnumClass) scan_types = g_type_class_ref (fp_scan_type_get_type ());
-          GEnumValue *value = g_enum_get_value_by_nick (scan_types, scan_type);
 
-          if (value)
-            fpi_device_set_scan_type (FP_DEVICE (self), value->value);
-          else
-            g_warning ("Scan type '%s' not found", scan_type);
-        }
-      else if (g_str_has_prefix (cmd, SET_CANCELLATION_PREFIX))
-        {
-          self->supports_cancellation = g_ascii_strtoull (
-            cmd + strlen (SET_CANCELLATION_PREFIX), NULL, 10) != 0;
+      g_warning ("Error receiving instruction data: %s", error->message);
+      return;
+    }
 
-          g_debug ("Cancellation support toggled: %d",
-                   self->supports_cancellation);
-        }
-      else if (g_str_has_prefix (cmd, SET_KEEP_ALIVE_PREFIX))
-        {
-          self->keep_alive = g_ascii_strtoull (
-            cmd + strlen (SET_KEEP_ALIVE_PREFIX), NULL, 10) != 0;
+  /* The connection got replaced, the new one is being read already */
+  if (bytes == 0)
+    return;
 
-          g_debug ("Keep alive toggled: %d", self->keep_alive);
-        }
-      else
-        {
-          g_ptr_array_add (self->pending_commands, g_steal_pointer (&cmd));
-          g_clear_handle_id (&self->wait_command_id, g_source_remove);
+  self = FP_DEVICE_VIRTUAL_DEVICE (user_data);
 
-          maybe_continue_current_action (self);
-        }
+  /* Clients may also send a single unterminated command per connection, and
+   * wait for its effect (or the LIST reply) before closing. So a chunk with
+   * no newline that does not continue a previous one is a whole command. */
+  if (self->recv_data->len == 0 && !memchr (self->recv_buf, '\n', bytes))
+    {
+      if (process_instruction (self, listener, g_strndup (self->recv_buf, bytes)) &&
+          self->listener == listener)
+        recv_instruction (self);
+      return;
     }
 
-  fpi_device_virtual_listener_connection_close (listener);
+  g_string_append_len (self->recv_data, self->recv_buf, bytes);
+
+  /* Processing a command may also have stopped the listener */
+  if (process_received_data (self, listener) && self->listener == listener)
+    recv_instruction (self);
 }
 
 static void
@@ -373,7 +467,9 @@ on_listener_connected (FpiDeviceVirtualListener *listener,
 {
   FpDeviceVirtualDevice *self = FP_DEVICE_VIRTUAL_DEVICE (user_data);
 
-  recv_instruction (self);
+  /* Handle what may be left from the previous client first */
+  if (flush_received_data (self, listener) && self->listener == listener)
+    recv_instruction (self);
 }
 
 static void
@@ -710,6 +806,7 @@ stop_listener (FpDeviceVirtualDevice *self)
   g_cancellable_cancel (self->cancellable);
   g_clear_object (&self->cancellable);
   g_clear_object (&self->listener);
+  g_string_truncate (self->recv_data, 0);
 }
 
 static void
@@ -752,6 +849,7 @@ fpi_device_virtual_device_finalize (GObject *object)
   G_DEBUG_HERE ();
   stop_listener (self);
   g_clear_pointer (&self->pending_commands, g_ptr_array_unref);
+  g_string_free (self->recv_data, TRUE);
   G_OBJECT_CLASS (fpi_device_virtual_device_parent_class)->finalize (object);
 }
 
@@ -760,6 +858,7 @@ fpi_device_virtual_device_init (FpDeviceVirtualDevice *self)
 {
   self->supports_cancellation = TRUE;
   self->pending_commands = g_ptr_array_new_with_free_func (g_free);
+  self->recv_data = g_string_new (NULL);
 }
 
 static const FpIdEntry driver_ids[] = {
@@ -12,6 +12,7 @@ from gi.repository import FPrint, GLib
 sys.excepthook = lambda *args: (traceback.print_exception(*args), sys.exit(1))
 
 ctx = GLib.main_context_default()
+loop = GLib.MainLoop(ctx)
 
 c = FPrint.Context()
 c.enumerate()
@@ -37,8 +38,7 @@ def enroll_progress(*args):
     print('enroll progress: ' + str(args))
 
 def identify_done(dev, res):
-    global identified
-    identified = True
+    loop.quit()
     identify_match, identify_print = dev.identify_finish(res)
     print('indentification_done: ', identify_match, identify_print)
     assert identify_match.equal(identify_print)
@@ -80,7 +80,6 @@ assert d.get_finger_status() == FPrint.FingerStatusFlags.NONE
 print("verify done")
 assert verify_res == True
 
-identified = False
 deserialized_prints = []
 for p in stored:
     deserialized_prints.append(FPrint.Print.deserialize(p.serialize()))
@@ -91,8 +90,7 @@ print('async identifying')
 d.identify(deserialized_prints, callback=identify_done)
 del deserialized_prints
 
-while not identified:
-    ctx.iteration(True)
+loop.run()
 
 print("try to enroll duplicate")
 template = FPrint.Print.new(d)
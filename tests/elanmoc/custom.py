@@ -11,6 +11,7 @@ from gi.repository import FPrint, GLib
 sys.excepthook = lambda *args: (traceback.print_exception(*args), sys.exit(1))
 
 ctx = GLib.main_context_default()
+loop = GLib.MainLoop(ctx)
 
 c = FPrint.Context()
 c.enumerate()
@@ -39,8 +40,7 @@ def enroll_progress(*args):
     print('enroll progress: ' + str(args))
 
 def identify_done(dev, res):
-    global identified
-    identified = True
+    loop.quit()
     identify_match, identify_print = dev.identify_finish(res)
     print('indentification_done: ', identify_match, identify_print)
     assert identify_match.equal(identify_print)
@@ -65,7 +65,6 @@ print("verify done")
 del p
 assert verify_res == True
 
-identified = False
 deserialized_prints = []
 for p in stored:
     deserialized_prints.append(FPrint.Print.deserialize(p.serialize()))
@@ -76,8 +75,7 @@ print('async identifying')
 d.identify(deserialized_prints, callback=identify_done)
 del deserialized_prints
 
-while not identified:
-    ctx.iteration(True)
+loop.run()
 
 print("deleting")
 d.delete_print_sync(p)
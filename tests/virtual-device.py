@@ -27,20 +27,12 @@ sys.excepthook = lambda *args: (traceback.print_exception(*args), sys.exit(1))
 
 ctx = GLib.main_context_default()
 
+CAMEL_CASE_RE = re.compile(r'(?<!^)(?=[A-Z])')
 
-class Connection:
-
-    def __init__(self, addr):
-        self.addr = addr
-
-    def __enter__(self):
-        self.con = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        self.con.connect(self.addr)
-        return self.con
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self.con.close()
-        del self.con
+VALID_COMMANDS = frozenset([
+    'INSERT', 'REMOVE', 'SCAN', 'ERROR', 'RETRY', 'FINGER', 'UNPLUG', 'SLEEP',
+    'SET_ENROLL_STAGES', 'SET_SCAN_TYPE', 'SET_CANCELLATION_ENABLED',
+    'SET_KEEP_ALIVE', 'IGNORED_COMMAND', 'CONT', 'RESET'])
 
 
 class GLibErrorMessage:
@@ -77,14 +69,16 @@ class VirtualDeviceBase(unittest.TestCase):
 
         driver_name = cls.driver_name if hasattr(cls, 'driver_name') else None
         if not driver_name:
-            driver_name = re.compile(r'(?<!^)(?=[A-Z])').sub(
-                '_', cls.__name__).lower()
+            driver_name = CAMEL_CASE_RE.sub('_', cls.__name__).lower()
 
         sock_name = driver_name.replace('_', '-')
         cls.sockaddr = os.path.join(cls.tmpdir, '{}.socket'.format(sock_name))
         os.environ['FP_{}'.format(driver_name.upper())] = cls.sockaddr
 
         cls._driver_name = driver_name
+        cls._connection = None
+        cls._enroll_cache = {}
+        cls._blank_print = None
 
         if cls.USE_CLASS_DEVICE:
             cls.ctx = FPrint.Context()
@@ -94,6 +88,7 @@ class VirtualDeviceBase(unittest.TestCase):
 
     @classmethod
     def tearDownClass(cls):
+        cls.close_connection()
         shutil.rmtree(cls.tmpdir)
         if cls.USE_CLASS_DEVICE:
             del cls.dev
@@ -114,80 +109,161 @@ class VirtualDeviceBase(unittest.TestCase):
     def tearDown(self):
         if self._close_on_teardown:
             self.assertTrue(self.dev.is_open())
+            # Only resends the enroll stages if the test changed them
+            self.set_enroll_stages(self.DEFAULT_ENROLL_STEPS)
             self.set_keep_alive(False)
-            self.send_command('SET_ENROLL_STAGES', self.DEFAULT_ENROLL_STEPS)
             self.dev.close_sync()
         self.assertFalse(self.dev.is_open())
         if not self.USE_CLASS_DEVICE:
+            self.close_connection()
             del self.dev
             del self.ctx
         super().tearDown()
 
     def wait_timeout(self, interval):
-        timeout_reached = False
+        loop = GLib.MainLoop(ctx)
         def on_timeout():
-            nonlocal timeout_reached
-            timeout_reached = True
+            loop.quit()
+            return GLib.SOURCE_REMOVE
 
         GLib.timeout_add(interval, on_timeout)
-        while not timeout_reached:
-            ctx.iteration(False)
+        loop.run()
 
-    def send_command(self, command, *args):
-        self.assertIn(command, ['INSERT', 'REMOVE', 'SCAN', 'ERROR', 'RETRY',
-            'FINGER', 'UNPLUG', 'SLEEP', 'SET_ENROLL_STAGES', 'SET_SCAN_TYPE',
-            'SET_CANCELLATION_ENABLED', 'SET_KEEP_ALIVE', 'IGNORED_COMMAND',
-            'CONT'])
+    def drain_events(self, max_iterations=64):
+        for _ in range(max_iterations):
+            if not ctx.pending():
+                break
+            ctx.iteration(False)
 
-        with Connection(self.sockaddr) as con:
-            params = ' '.join(str(p) for p in args)
-            con.sendall('{} {}'.format(command, params).encode('utf-8'))
+    @classmethod
+    def close_connection(cls):
+        if cls._connection:
+            cls._connection.close()
+            cls._connection = None
 
-        while ctx.pending():
-            ctx.iteration(False)
+    @classmethod
+    def get_connection(cls):
+        if not cls._connection:
+            con = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            con.connect(cls.sockaddr)
+            cls._connection = con
+        return cls._connection
 
-    def send_finger_report(self, has_finger, iterate=True):
+    @classmethod
+    def send_payload(cls, payload):
+        try:
+            cls.get_connection().sendall(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            # The driver drops the connection when its listener is stopped,
+            # so connect again to the one of the re-opened device
+            cls.close_connection()
+            cls.get_connection().sendall(payload)
+
+    def send_command(self, command, *args, batch=None, drain=True):
+        self.assertIn(command, VALID_COMMANDS)
+
+        params = ' '.join(str(p) for p in args)
+        payload = '{} {}\n'.format(command, params).encode('utf-8')
+
+        if batch is not None:
+            batch.append(payload)
+            return
+
+        self.send_payload(payload)
+        if drain:
+            self.drain_events()
+
+    def flush_commands(self, batch):
+        self.send_payload(b''.join(batch))
+        batch.clear()
+        self.drain_events()
+
+    def send_finger_report(self, has_finger, iterate=True, batch=None):
+        # We can only wait for the status change of a command that is sent
+        self.assertFalse(iterate and batch is not None)
+
+        if not iterate:
+            # Only scanning actions consume it, and those wait for commands
+            self.send_command('FINGER', 1 if has_finger else 0, batch=batch,
+                drain=False)
+            return
+
+        expected = (FPrint.FingerStatusFlags.PRESENT if has_finger
+            else ~FPrint.FingerStatusFlags.PRESENT)
+        loop = GLib.MainLoop(ctx)
+
+        def on_finger_status_changed(dev, spec):
+            if dev.get_finger_status() & expected:
+                loop.quit()
+
+        handler = self.dev.connect('notify::finger-status',
+            on_finger_status_changed)
         self.send_command('FINGER', 1 if has_finger else 0)
 
-        if iterate:
-            expected = (FPrint.FingerStatusFlags.PRESENT if has_finger
-                else ~FPrint.FingerStatusFlags.PRESENT)
-
-            while not (self.dev.get_finger_status() & expected):
-                ctx.iteration(True)
+        # The status may have changed already while handling the command
+        if not (self.dev.get_finger_status() & expected):
+            loop.run()
+        self.dev.disconnect(handler)
 
-    def send_error(self, error):
+    def send_error(self, error, batch=None, drain=True):
+        # Errors can be consumed by open and close, which do not wait for
+        # commands, so they need to be received before starting those
         self.assertIsInstance(error, FPrint.DeviceError)
-        self.send_command('ERROR', int(error))
+        self.send_command('ERROR', int(error), batch=batch, drain=drain)
 
-    def send_retry(self, retry):
+    def send_retry(self, retry, batch=None):
         self.assertIsInstance(retry, FPrint.DeviceRetry)
-        self.send_command('RETRY', int(retry))
+        self.send_command('RETRY', int(retry), batch=batch, drain=False)
 
-    def send_auto(self, obj):
+    def send_auto(self, obj, batch=None):
         if isinstance(obj, FPrint.DeviceError):
-            self.send_error(obj)
+            self.send_error(obj, batch=batch)
         elif isinstance(obj, FPrint.DeviceRetry):
-            self.send_retry(obj)
+            self.send_retry(obj, batch=batch)
         elif isinstance(obj, FPrint.FingerStatusFlags):
-            self.send_finger_report(obj & FPrint.FingerStatusFlags.PRESENT, iterate=False)
+            self.send_finger_report(obj & FPrint.FingerStatusFlags.PRESENT,
+                iterate=False, batch=batch)
         elif isinstance(obj, FPrint.ScanType):
-            self.send_command('SET_SCAN_TYPE', obj.value_nick)
+            self.send_command('SET_SCAN_TYPE', obj.value_nick, batch=batch)
         elif isinstance(obj, FPrint.Print) and obj.props.fpi_data:
-            self.send_command('SCAN', obj.props.fpi_data.unpack())
+            self.send_command('SCAN', obj.props.fpi_data.unpack(), batch=batch)
         else:
             raise Exception('No known type found for {}'.format(obj))
 
-    def set_keep_alive(self, value):
-        self.send_command('SET_KEEP_ALIVE', 1 if value else 0)
+    def set_keep_alive(self, value, batch=None):
+        self.send_command('SET_KEEP_ALIVE', 1 if value else 0, batch=batch)
 
-    def send_sleep(self, interval):
+    def set_enroll_stages(self, stages, batch=None):
+        # Queued commands did not reach the driver yet, so the device
+        # state can't tell whether batching this one is needed
+        if batch is not None or self.dev.get_nr_enroll_stages() != stages:
+            self.send_command('SET_ENROLL_STAGES', stages, batch=batch)
+
+    def send_sleep(self, interval, batch=None, drain=True):
         self.assertGreater(interval, 0)
         multiplier = 5 if 'UNDER_VALGRIND' in os.environ else 1
-        self.send_command('SLEEP', interval * multiplier)
+        self.send_command('SLEEP', interval * multiplier, batch=batch,
+            drain=drain)
+
+    def blank_print(self):
+        # Prints that are only verified, identified or deleted (and so never
+        # modified) can all be the same one, unlike enroll templates
+        if self._blank_print is None:
+            type(self)._blank_print = FPrint.Print.new(self.dev)
+        return self._blank_print
+
+    def enroll_print(self, nick, finger, username='testuser', retry_scan=-1,
+                     cached=False):
+        # Tests that only need an enrolled print can reuse one of a previous
+        # test, as long as the device storage can be populated with it
+        cache_key = (nick, finger, username, retry_scan)
+        cached = cached and self.dev.has_storage()
+        if cached and cache_key in self._enroll_cache:
+            self.send_command('INSERT', nick)
+            return FPrint.Print.deserialize(self._enroll_cache[cache_key])
 
-    def enroll_print(self, nick, finger, username='testuser', retry_scan=-1):
         self._enrolled = None
+        loop = GLib.MainLoop(ctx)
 
         def done_cb(dev, res):
             print("Enroll done")
@@ -195,51 +271,46 @@ class VirtualDeviceBase(unittest.TestCase):
                 self._enrolled = dev.enroll_finish(res)
             except Exception as e:
                 self._enrolled = e
+            loop.quit()
 
-        self._enroll_stage = -1
-        def progress_cb(dev, stage, pnt, data, error):
-            self._enroll_stage = stage
-            self._enroll_progress_error = error
+        # The number of stages can't change while we are enrolling
+        nr_stages = self.dev.get_nr_enroll_stages()
+        finger_needed = FPrint.FingerStatusFlags.NEEDED
+        finger_none = FPrint.FingerStatusFlags.NONE
 
-        self.assertLessEqual(retry_scan, self.dev.get_nr_enroll_stages())
+        self.assertLessEqual(retry_scan, nr_stages)
 
         retries = 1
         should_retry = retry_scan > 0
 
-        def enroll_in_progress():
-            if self._enroll_stage < 0 and not self._enrolled:
-                return True
-
-            if isinstance(self._enrolled, Exception):
-                raise(self._enrolled)
-
+        self._enroll_stage = -1
+        def progress_cb(dev, stage, pnt, data, error):
             nonlocal retries
-            self.assertLessEqual(self._enroll_stage, self.dev.get_nr_enroll_stages())
+            self._enroll_stage = stage
+            self._enroll_progress_error = error
+
+            self.assertLessEqual(stage, nr_stages)
             if should_retry and retries > retry_scan:
-                self.assertEqual(self._enroll_stage, retries - 1)
+                self.assertEqual(stage, retries - 1)
             else:
-                self.assertEqual(self._enroll_stage, retries)
+                self.assertEqual(stage, retries)
 
             if retries == retry_scan + 1:
-                self.assertIsNotNone(self._enroll_progress_error)
-                self.assertEqual(self._enroll_progress_error.code, FPrint.DeviceRetry.TOO_SHORT)
+                self.assertIsNotNone(error)
+                self.assertEqual(error.code, FPrint.DeviceRetry.TOO_SHORT)
             else:
-                self.assertIsNone(self._enroll_progress_error)
+                self.assertIsNone(error)
 
-            if self._enroll_stage < self.dev.get_nr_enroll_stages():
-                self._enroll_stage = -1
+            if stage < nr_stages:
                 self.assertIsNone(self._enrolled)
-                self.assertEqual(self.dev.get_finger_status(),
-                    FPrint.FingerStatusFlags.NEEDED)
+                self.assertEqual(self.dev.get_finger_status(), finger_needed)
                 if retry_scan == retries:
                     GLib.idle_add(self.send_auto, FPrint.DeviceRetry.TOO_SHORT)
                 else:
                     GLib.idle_add(self.send_command, 'SCAN', nick)
                 retries += 1
 
-            return not self._enrolled
-
-        self.assertEqual(self.dev.get_finger_status(), FPrint.FingerStatusFlags.NONE)
+        self.assertEqual(self.dev.get_finger_status(), finger_none)
 
         self.send_command('SCAN', nick)
 
@@ -248,12 +319,14 @@ class VirtualDeviceBase(unittest.TestCase):
         template.set_username(username)
 
         self.dev.enroll(template, callback=done_cb, progress_cb=progress_cb)
-        while enroll_in_progress():
-            ctx.iteration(False)
+        loop.run()
+
+        if isinstance(self._enrolled, Exception):
+            raise(self._enrolled)
 
         self.assertEqual(self._enroll_stage, retries if not should_retry else retries - 1)
-        self.assertEqual(self._enroll_stage, self.dev.get_nr_enroll_stages())
-        self.assertEqual(self.dev.get_finger_status(), FPrint.FingerStatusFlags.NONE)
+        self.assertEqual(self._enroll_stage, nr_stages)
+        self.assertEqual(self.dev.get_finger_status(), finger_none)
 
         self.assertEqual(self._enrolled.get_device_stored(),
             bool(self.dev.get_features() & FPrint.DeviceFeature.STORAGE))
@@ -264,6 +337,9 @@ class VirtualDeviceBase(unittest.TestCase):
         self.assertEqual(self._enrolled.props.fpi_data.unpack(), nick)
         self.assertIsNone(self._enrolled.props.image)
 
+        if cached:
+            self._enroll_cache[cache_key] = self._enrolled.serialize()
+
         return self._enrolled
 
     def start_verify(self, p, identify=False):
@@ -274,6 +350,7 @@ class VirtualDeviceBase(unittest.TestCase):
         self._verify_report_print = None
         self._verify_completed = False
         self._verify_reported = False
+        self._verify_loop = GLib.MainLoop(ctx)
         self._cancellable = Gio.Cancellable()
 
         if identify:
@@ -293,6 +370,7 @@ class VirtualDeviceBase(unittest.TestCase):
                 self._verify_error = e
 
             self._verify_completed = True
+            self._verify_loop.quit()
 
         if identify:
             self.dev.identify(p if isinstance(p, list) else [p],
@@ -301,18 +379,21 @@ class VirtualDeviceBase(unittest.TestCase):
             self.dev.verify(p, cancellable=self._cancellable, match_cb=match_cb,
                 callback=verify_cb)
 
+    def wait_verify(self):
+        # The loop may have been quit already, while we were not running it
+        if not self._verify_completed:
+            self._verify_loop.run()
+
     def cancel_verify(self):
         self._cancellable.cancel()
-        while not self._verify_completed:
-            ctx.iteration(True)
+        self.wait_verify()
 
         self.assertIsNone(self._verify_match)
         self.assertIsNotNone(self._verify_error)
         self.assertEqual(self.dev.get_finger_status(), FPrint.FingerStatusFlags.NONE)
 
     def complete_verify(self):
-        while not self._verify_completed:
-            ctx.iteration(True)
+        self.wait_verify()
 
         if self._verify_error is not None:
             raise self._verify_error
@@ -422,7 +503,7 @@ class VirtualDeviceUnplugging(VirtualDeviceBase):
         self.ctx.connect('device-removed', on_ctx_removed)
         self.dev.connect('removed', on_removed)
 
-        self.start_verify(FPrint.Print.new(self.dev),
+        self.start_verify(self.blank_print(),
             identify=self.dev.supports_identify())
 
         self.send_command('UNPLUG')
@@ -609,7 +690,7 @@ class VirtualDevice(VirtualDeviceBase):
 
     def test_enroll_verify_retry(self):
         with self.assertRaises(GLib.GError) as error:
-            self.check_verify(FPrint.Print.new(self.dev),
+            self.check_verify(self.blank_print(),
                 FPrint.DeviceRetry.TOO_SHORT, match=False)
         self.assertTrue(error.exception.matches(FPrint.DeviceRetry.quark(),
                                                 FPrint.DeviceRetry.TOO_SHORT))
@@ -645,16 +726,18 @@ class VirtualDevice(VirtualDeviceBase):
                 self.assertIsNone(enroll_progress_error)
             self.assertIsNone(enrolled)
 
-        self.send_sleep(50)
-        self.send_command('SCAN', 'print-id')
-        self.send_command('SCAN', 'print-id')
-        self.send_auto(FPrint.DeviceRetry.TOO_SHORT)
-        self.send_command('SCAN', 'print-id')
-        self.send_sleep(50)
-        self.send_command('SCAN', 'print-id')
-        self.send_auto(FPrint.DeviceRetry.CENTER_FINGER)
-        self.send_command('SCAN', 'another-id')
-        self.send_command('SCAN', 'print-id')
+        batch = []
+        self.send_sleep(50, batch=batch)
+        self.send_command('SCAN', 'print-id', batch=batch)
+        self.send_command('SCAN', 'print-id', batch=batch)
+        self.send_auto(FPrint.DeviceRetry.TOO_SHORT, batch=batch)
+        self.send_command('SCAN', 'print-id', batch=batch)
+        self.send_sleep(50, batch=batch)
+        self.send_command('SCAN', 'print-id', batch=batch)
+        self.send_auto(FPrint.DeviceRetry.CENTER_FINGER, batch=batch)
+        self.send_command('SCAN', 'another-id', batch=batch)
+        self.send_command('SCAN', 'print-id', batch=batch)
+        self.flush_commands(batch)
 
         self.dev.enroll(FPrint.Print.new(self.dev), callback=done_cb,
             progress_cb=progress_cb)
@@ -675,23 +758,25 @@ class VirtualDevice(VirtualDeviceBase):
         self.assertEqual(enrolled.props.fpi_data.unpack(), 'print-id')
 
     def test_enroll_script(self):
-        self.send_command('SET_ENROLL_STAGES', 8)
-        self.send_command('SCAN', 'print-id')
-        self.send_command('SCAN', 'print-id')
-        self.send_auto(FPrint.DeviceRetry.TOO_SHORT)
-        self.send_command('SCAN', 'print-id')
-        self.send_auto(FPrint.DeviceRetry.REMOVE_FINGER)
-        self.send_command('SCAN', 'print-id')
-        self.send_auto(FPrint.DeviceRetry.CENTER_FINGER)
-        self.send_command('SCAN', 'print-id')
-        self.send_sleep(10)
-        self.send_sleep(20)
-        self.send_auto(FPrint.DeviceRetry.GENERAL)
-        self.send_auto(FPrint.DeviceRetry.REMOVE_FINGER)
-        self.send_command('SCAN', 'print-id')
-        self.send_command('SCAN', 'another-id')
-        self.send_command('SCAN', 'print-id')
-        self.send_command('SCAN', 'print-id')
+        batch = []
+        self.set_enroll_stages(8, batch=batch)
+        self.send_command('SCAN', 'print-id', batch=batch)
+        self.send_command('SCAN', 'print-id', batch=batch)
+        self.send_auto(FPrint.DeviceRetry.TOO_SHORT, batch=batch)
+        self.send_command('SCAN', 'print-id', batch=batch)
+        self.send_auto(FPrint.DeviceRetry.REMOVE_FINGER, batch=batch)
+        self.send_command('SCAN', 'print-id', batch=batch)
+        self.send_auto(FPrint.DeviceRetry.CENTER_FINGER, batch=batch)
+        self.send_command('SCAN', 'print-id', batch=batch)
+        self.send_sleep(10, batch=batch)
+        self.send_sleep(20, batch=batch)
+        self.send_auto(FPrint.DeviceRetry.GENERAL, batch=batch)
+        self.send_auto(FPrint.DeviceRetry.REMOVE_FINGER, batch=batch)
+        self.send_command('SCAN', 'print-id', batch=batch)
+        self.send_command('SCAN', 'another-id', batch=batch)
+        self.send_command('SCAN', 'print-id', batch=batch)
+        self.send_command('SCAN', 'print-id', batch=batch)
+        self.flush_commands(batch)
 
         enrolled = self.dev.enroll_sync(FPrint.Print.new(self.dev))
         self.assertEqual(enrolled.get_driver(), self.dev.get_driver())
@@ -707,7 +792,7 @@ class VirtualDevice(VirtualDeviceBase):
         self.assertTrue(error.exception.matches(FPrint.DeviceRetry.quark(),
                                                 FPrint.DeviceRetry.CENTER_FINGER))
 
-        self.send_sleep(50)
+        self.send_sleep(50, drain=False)
         self.send_auto(FPrint.DeviceRetry.TOO_SHORT)
         with self.assertRaises(GLib.GError) as error:
             self.dev.verify_sync(enrolled)
@@ -728,7 +813,7 @@ class VirtualDevice(VirtualDeviceBase):
         self.assertTrue(verify_fp.equal(enrolled))
 
     def test_finger_status(self):
-        self.start_verify(FPrint.Print.new(self.dev),
+        self.start_verify(self.blank_print(),
             identify=self.dev.supports_identify())
 
         self.assertEqual(self.dev.get_finger_status(),
@@ -745,7 +830,7 @@ class VirtualDevice(VirtualDeviceBase):
 
     def test_finger_status_after_sleep(self):
         self.send_sleep(10)
-        self.start_verify(FPrint.Print.new(self.dev),
+        self.start_verify(self.blank_print(),
                           identify=self.dev.supports_identify())
 
         self.assertEqual(self.dev.get_finger_status(),
@@ -793,7 +878,7 @@ class VirtualDevice(VirtualDeviceBase):
             self.assertIsNone(notified_spec)
 
     def test_quick_enroll(self):
-        self.send_command('SET_ENROLL_STAGES', 1)
+        self.set_enroll_stages(1)
         self.assertEqual(self.dev.get_nr_enroll_stages(), 1)
         matching = self.enroll_print('testprint', FPrint.Finger.LEFT_LITTLE)
         self.assertEqual(matching.get_username(), 'testuser')
@@ -820,10 +905,27 @@ class VirtualDevice(VirtualDeviceBase):
             self.assertEqual(self.dev.get_scan_type(), FPrint.ScanType.SWIPE)
             self.assertIsNone(notified_spec)
 
+    def test_unterminated_command(self):
+        self.send_auto(FPrint.ScanType.SWIPE)
+        self.close_connection()
+
+        # One-shot clients don't terminate their command, nor close the
+        # connection before it took effect
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as con:
+            con.connect(self.sockaddr)
+            con.sendall('SET_SCAN_TYPE {}'.format(
+                FPrint.ScanType.PRESS.value_nick).encode('utf-8'))
+
+            while self.dev.get_scan_type() != FPrint.ScanType.PRESS:
+                ctx.iteration(True)
+
+        self.send_auto(FPrint.ScanType.SWIPE)
+        self.assertEqual(self.dev.get_scan_type(), FPrint.ScanType.SWIPE)
+
     def test_device_sleep(self):
-        self.send_sleep(1500)
+        self.send_sleep(1500, drain=False)
 
-        self.start_verify(FPrint.Print.new(self.dev),
+        self.start_verify(self.blank_print(),
             identify=self.dev.supports_identify())
 
         self.wait_timeout(300)
@@ -836,11 +938,13 @@ class VirtualDevice(VirtualDeviceBase):
         self.cancel_verify()
 
     def test_device_sleep_on_cancellation(self):
-        self.send_command('SET_CANCELLATION_ENABLED', int(False))
-        self.send_sleep(1500)
-        self.send_command('SCAN', 'foo-print')
+        batch = []
+        self.send_command('SET_CANCELLATION_ENABLED', int(False), batch=batch)
+        self.send_sleep(1500, batch=batch)
+        self.send_command('SCAN', 'foo-print', batch=batch)
+        self.flush_commands(batch)
 
-        self.start_verify(FPrint.Print.new(self.dev),
+        self.start_verify(self.blank_print(),
             identify=self.dev.supports_identify())
         self.wait_timeout(300)
 
@@ -863,8 +967,10 @@ class VirtualDevice(VirtualDeviceBase):
 
         self.send_sleep(100)
         self.start_verify(enrolled, identify=self.dev.supports_identify())
-        self.send_command('SCAN', 'bar-print')
-        self.send_sleep(800)
+        batch = []
+        self.send_command('SCAN', 'bar-print', batch=batch)
+        self.send_sleep(800, batch=batch)
+        self.flush_commands(batch)
 
         while not self._verify_reported:
             ctx.iteration(False)
@@ -1053,8 +1159,8 @@ class VirtualDeviceStorage(VirtualDevice):
 
     def cleanup_device_storage(self):
         if self.dev.is_open() and not self.dev.props.removed:
-            self.send_command('CONT')
-            self.dev.clear_storage_sync()
+            # Wipes the storage and drops the commands the test left queued
+            self.send_command('RESET')
 
     def test_device_properties(self):
         self.assertEqual(self.dev.get_driver(), 'virtual_device_storage')
@@ -1093,6 +1199,42 @@ class VirtualDeviceStorage(VirtualDevice):
         print2 = self.enroll_print('p2', FPrint.Finger.LEFT_LITTLE)
         self.assertEqual({'p1', 'p2'}, {p.props.fpi_data.get_string() for p in self.dev.list_prints_sync()})
 
+    def test_list_unterminated_command(self):
+        self.send_command('INSERT', 'p1')
+        self.send_command('INSERT', 'p2')
+        self.assertEqual(len(self.dev.list_prints_sync()), 2)
+        self.close_connection()
+
+        timeout_reached = False
+        def on_timeout():
+            nonlocal timeout_reached
+            timeout_reached = True
+
+        timeout_id = GLib.timeout_add(5000, on_timeout)
+
+        # The reply is read until the driver closes the connection, so the
+        # command has to be handled without waiting for the client to do it
+        reply = b''
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as con:
+            con.connect(self.sockaddr)
+            con.setblocking(False)
+            con.sendall(b'LIST ')
+
+            while True:
+                try:
+                    data = con.recv(1024)
+                except BlockingIOError:
+                    self.assertFalse(timeout_reached)
+                    ctx.iteration(True)
+                    continue
+                if not data:
+                    break
+                reply += data
+
+        if not timeout_reached:
+            GLib.source_remove(timeout_id)
+        self.assertEqual({'p1', 'p2'}, set(reply.decode('utf-8').split()))
+
     def test_list_delete(self):
         p = self.enroll_print('testprint', FPrint.Finger.RIGHT_THUMB)
         l = self.dev.list_prints_sync()
@@ -1114,7 +1256,7 @@ class VirtualDeviceStorage(VirtualDevice):
 
         self.send_sleep(100)
         self.send_error(FPrint.DeviceError.DATA_NOT_FOUND)
-        self.dev.delete_print(FPrint.Print.new(self.dev), callback=on_deleted)
+        self.dev.delete_print(self.blank_print(), callback=on_deleted)
         self.wait_timeout(2)
         self.assertIsNone(deleted_res)
 
@@ -1145,7 +1287,7 @@ class VirtualDeviceStorage(VirtualDevice):
         self.assertEqual(list_res.code, int(FPrint.DeviceError.BUSY))
 
     def test_list_delete_missing(self):
-        p = self.enroll_print('testprint', FPrint.Finger.RIGHT_THUMB)
+        p = self.enroll_print('testprint', FPrint.Finger.RIGHT_THUMB, cached=True)
         self.send_command('REMOVE', 'testprint')
 
         with self.assertRaises(GLib.Error) as error:
@@ -1162,6 +1304,20 @@ class VirtualDeviceStorage(VirtualDevice):
         self.dev.clear_storage_sync()
         self.assertFalse(self.dev.list_prints_sync())
 
+    def test_reset_storage(self):
+        batch = []
+        self.send_command('INSERT', 'p1', batch=batch)
+        self.send_command('INSERT', 'p2', batch=batch)
+        self.flush_commands(batch)
+        self.assertEqual(len(self.dev.list_prints_sync()), 2)
+
+        batch = []
+        self.send_command('INSERT', 'p3', batch=batch)
+        self.send_command('SCAN', 'p3', batch=batch)
+        self.send_command('RESET', batch=batch)
+        self.flush_commands(batch)
+        self.assertFalse(self.dev.list_prints_sync())
+
     def test_clear_storage_error(self):
         self.send_command('INSERT', 'p1')
         l = self.dev.list_prints_sync()
@@ -1174,29 +1330,33 @@ class VirtualDeviceStorage(VirtualDevice):
         self.assertTrue(error.exception.matches(FPrint.DeviceError.quark(),
                                                 FPrint.DeviceError.PROTO))
 
+    def enroll_thumbs(self):
+        # Only enrolled once per class, the following tests just insert them
+        rt = self.enroll_print('right-thumb', FPrint.Finger.RIGHT_THUMB, cached=True)
+        lt = self.enroll_print('left-thumb', FPrint.Finger.LEFT_THUMB, cached=True)
+        return rt, lt
+
     def test_identify_match(self):
-        rt = self.enroll_print('right-thumb', FPrint.Finger.RIGHT_THUMB)
-        lt = self.enroll_print('left-thumb', FPrint.Finger.LEFT_THUMB)
+        rt, lt = self.enroll_thumbs()
 
         self.check_verify([rt, lt], 'right-thumb', identify=True, match=True)
         self.check_verify([rt, lt], 'left-thumb', identify=True, match=True)
 
     def test_identify_no_match(self):
-        rt = self.enroll_print('right-thumb', FPrint.Finger.RIGHT_THUMB)
-        lt = self.enroll_print('left-thumb', FPrint.Finger.LEFT_THUMB)
+        rt, lt = self.enroll_thumbs()
 
         self.check_verify(lt, 'right-thumb', identify=True, match=False)
         self.check_verify(rt, 'left-thumb', identify=True, match=False)
 
     def test_identify_retry(self):
         with self.assertRaises(GLib.GError) as error:
-            self.check_verify(FPrint.Print.new(self.dev),
+            self.check_verify(self.blank_print(),
                 FPrint.DeviceRetry.TOO_SHORT, identify=True, match=False)
         self.assertTrue(error.exception.matches(FPrint.DeviceRetry.quark(),
                                                 FPrint.DeviceRetry.TOO_SHORT))
 
     def test_delete_multiple_times(self):
-        rt = self.enroll_print('right-thumb', FPrint.Finger.RIGHT_THUMB)
+        rt = self.enroll_print('right-thumb', FPrint.Finger.RIGHT_THUMB, cached=True)
         self.dev.delete_print_sync(rt)
 
         with self.assertRaises(GLib.Error) as error:
@@ -1205,11 +1365,11 @@ class VirtualDeviceStorage(VirtualDevice):
                                                 FPrint.DeviceError.DATA_NOT_FOUND))
 
     def test_verify_missing_print(self):
-        self.check_verify(FPrint.Print.new(self.dev),
+        self.check_verify(self.blank_print(),
             'not-existing-print', False, identify=False)
 
     def test_identify_missing_print(self):
-        self.check_verify(FPrint.Print.new(self.dev),
+        self.check_verify(self.blank_print(),
                           'not-existing-print', False, identify=True)
 
 